@@ -13,9 +13,9 @@ look up the handler for a transaction in progress.
 import collections
 import logging
 import typing
+import urllib.parse
 
 import expiringdict
-from bs4 import BeautifulSoup
 
 from . import handlers, tokens, utils, webfinger
 
@@ -28,11 +28,21 @@ class Authl:
     :param cfg_handlers: The list of configured handlers, in decreasing priority
         order.
 
+    :param dict webfinger_cache: dict-like storage for caching WebFinger
+        lookups. Defaults to a process-local cache.
+
     """
 
-    def __init__(self, cfg_handlers: typing.List[handlers.Handler] = None):
+    def __init__(self, cfg_handlers: typing.List[handlers.Handler] = None,
+                 webfinger_cache: dict = None):
         """ Initialize an Authl library instance. """
+        self._webfinger_cache = webfinger_cache
         self._handlers: typing.Dict[str, handlers.Handler] = collections.OrderedDict()
+
+        # URL scheme -> candidate handlers, in priority order
+        self._by_scheme: typing.Dict[str, typing.List[typing.Tuple[str, handlers.Handler]]] = {}
+        self._any_scheme: typing.List[typing.Tuple[str, handlers.Handler]] = []
+
         if cfg_handlers:
             for handler in cfg_handlers:
                 self.add_handler(handler)
@@ -46,8 +56,23 @@ class Authl:
             raise ValueError("Already have handler with id " + cb_id)
         self._handlers[cb_id] = handler
 
+        schemes = handler.handled_schemes
+        if schemes is None:
+            self._any_scheme.append((cb_id, handler))
+            for candidates in self._by_scheme.values():
+                candidates.append((cb_id, handler))
+        else:
+            for scheme in schemes:
+                self._by_scheme.setdefault(scheme, list(self._any_scheme)).append((cb_id, handler))
+
     def _match_url(self, url: str):
-        for hid, handler in self._handlers.items():
+        try:
+            candidates = self._by_scheme.get(urllib.parse.urlparse(url).scheme)
+        except ValueError:
+            candidates = None
+
+        # Only fall back to every handler if nothing specifically claimed the scheme
+        for hid, handler in candidates or self._handlers.items():
             result = handler.handles_url(url)
             if result:
                 LOGGER.debug("%s URL matches %s", url, handler)
@@ -71,14 +96,23 @@ class Authl:
         """
 
         url = url.strip()
-
-        # If webfinger detects profiles for this address, try all of those first
-        for profile in webfinger.get_profiles(url):
-            LOGGER.debug("Checking profile %s", profile)
-            resp = self.get_handler_for_url(profile)
+        LOGGER.debug("Checking URL %s", url)
+
+        # If webfinger detects profiles for this address, try all of those
+        # first; they're probed concurrently since each one may need a fetch.
+        # (The profiles themselves don't get webfinger lookups, as a hostile
+        # server could otherwise send us around in circles.)
+        for resp in utils.concurrent_map(self._get_handler_for_profile,
+                                         webfinger.get_profiles(url, self._webfinger_cache)):
             if resp[0]:
                 return resp
 
+        return self._get_handler_for_profile(url)
+
+    def _get_handler_for_profile(self, url: str) -> typing.Tuple[
+            typing.Optional[handlers.Handler], str, str]:
+        """ Get the handler for a profile URL, without doing webfinger lookups """
+        url = url.strip()
         if not url:
             return None, '', ''
 
@@ -97,11 +131,14 @@ class Authl:
                 if by_url[0]:
                     return by_url
 
-            soup = BeautifulSoup(request.text, 'html.parser')
+            # Only parse the page if a handler needs to look at it, and then
+            # only once
+            content = utils.LazyPage(request)
+
             for hid, handler in self._handlers.items():
-                if handler.handles_page(profile, request.headers, soup, request.links):
+                if handler.handles_page(profile, request.headers, content, request.links):
                     LOGGER.debug("%s response matches %s", profile, handler)
-                    return handler, hid, request.url
+                    return handler, hid, profile
 
         LOGGER.debug("No handler found for URL %s", url)
         return None, '', ''
@@ -146,6 +183,14 @@ def from_config(config: typing.Dict[str, typing.Any],
 
     * ``TEST_ENABLED``: enable :py:mod:`authl.handlers.test_handler`
 
+    WebFinger lookups are cached according to the following keys:
+
+    * ``WEBFINGER_MAX_ENTRIES``: the maximum number of addresses to cache
+      (default: 4096)
+
+    * ``WEBFINGER_TTL``: how long to cache a lookup for, in seconds (default:
+      30 hours)
+
     For additional configuration settings, see each handler's respective
     ``from_config()``.
 
@@ -157,7 +202,13 @@ def from_config(config: typing.Dict[str, typing.Any],
     if state_storage is None:
         state_storage = expiringdict.ExpiringDict(max_len=1024, max_age_seconds=3600)
 
-    instance = Authl()
+    webfinger_cache = None
+    if 'WEBFINGER_MAX_ENTRIES' in config or 'WEBFINGER_TTL' in config:
+        webfinger_cache = expiringdict.ExpiringDict(
+            max_len=config.get('WEBFINGER_MAX_ENTRIES', 4096),
+            max_age_seconds=config.get('WEBFINGER_TTL', 30 * 3600))
+
+    instance = Authl(webfinger_cache=webfinger_cache)
 
     if config.get('EMAIL_FROM') or config.get('EMAIL_SENDMAIL'):
         from .handlers import email_addr
@@ -291,9 +291,7 @@ class AuthlFlask:
 
         if tester_path:
             def find_service():
-                from flask import request
-
-                url = request.args.get('url')
+                url = flask.request.args.get('url')
                 if not url:
                     return json.dumps(None)
 
@@ -310,35 +308,49 @@ class AuthlFlask:
         """ Provide the _scheme parameter to be sent along to flask.url_for """
         return 'https' if self.force_https else None
 
-    @_nocache()
-    def _handle_disposition(self, disp: disposition.Disposition):
-        if isinstance(disp, disposition.Redirect):
-            # A simple redirection
-            return flask.redirect(disp.url)
+    def _handle_redirect(self, disp: disposition.Redirect):
+        # A simple redirection
+        return flask.redirect(disp.url)
+
+    def _handle_verified(self, disp: disposition.Verified):
+        # The user is verified; log them in
+        self._session.pop(self._prefill_key, None)
 
-        if isinstance(disp, disposition.Verified):
-            # The user is verified; log them in
-            self._session.pop(self._prefill_key, None)
+        LOGGER.info("Successful login: %s", disp.identity)
+        if self._session_auth_name is not None:
+            flask.session.permanent = self.make_permanent
+            flask.session[self._session_auth_name] = disp.identity
 
-            LOGGER.info("Successful login: %s", disp.identity)
-            if self._session_auth_name is not None:
-                flask.session.permanent = self.make_permanent
-                flask.session[self._session_auth_name] = disp.identity
+        if self._on_verified:
+            response = self._on_verified(disp)
+            if response:
+                return response
 
-            if self._on_verified:
-                response = self._on_verified(disp)
-                if response:
-                    return response
+        return flask.redirect(disp.redir)
 
-            return flask.redirect(disp.redir)
+    def _handle_notify(self, disp: disposition.Notify):
+        # The user needs to take some additional action
+        return self._render_notify(disp.cdata)
 
-        if isinstance(disp, disposition.Notify):
-            # The user needs to take some additional action
-            return self._render_notify(disp.cdata)
+    def _handle_error(self, disp: disposition.Error):
+        # The user's login failed
+        return self.render_login_form(destination=disp.redir, error=disp.message)
 
-        if isinstance(disp, disposition.Error):
-            # The user's login failed
-            return self.render_login_form(destination=disp.redir, error=disp.message)
+    _DISPOSITION_HANDLERS: typing.Dict[type, typing.Callable] = {
+        disposition.Redirect: _handle_redirect,
+        disposition.Verified: _handle_verified,
+        disposition.Notify: _handle_notify,
+        disposition.Error: _handle_error,
+    }
+
+    @_nocache()
+    def _handle_disposition(self, disp: disposition.Disposition):
+        # Look up by type, falling back to the base classes for subclassed
+        # dispositions
+        for cls in type(disp).__mro__:
+            handler = self._DISPOSITION_HANDLERS.get(cls)
+            if handler:
+                return handler(self, disp)
 
         # unhandled disposition
         raise http_error.InternalServerError("Unknown disposition type " + str(type(disp)))
@@ -392,7 +404,7 @@ class AuthlFlask:
                                             **render_args)
 
     def _login_endpoint(self, redir: str = ''):
-        from flask import request
+        request = flask.request
 
         if 'asset' in request.args:
             asset = request.args['asset']
@@ -424,7 +436,7 @@ class AuthlFlask:
         return self.render_login_form(destination=dest, error=error)
 
     def _callback_endpoint(self, hid: str):
-        from flask import request
+        request = flask.request
 
         handler = self.authl.get_handler_by_id(hid)
         if not handler:
@@ -443,8 +455,7 @@ class AuthlFlask:
 def client_id():
     """ A shim to generate a client ID based on the current site URL, for use
     with IndieAuth. """
-    from flask import request
-    parsed = urllib.parse.urlparse(request.base_url)
+    parsed = urllib.parse.urlparse(flask.request.base_url)
     baseurl = f'{parsed.scheme}://{parsed.hostname}'
     LOGGER.debug("using client_id %s", baseurl)
     return baseurl
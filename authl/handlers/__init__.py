@@ -48,6 +48,19 @@ class Handler(ABC):
         # pylint:disable=no-self-use,unused-argument
         return None
 
+    @property
+    def handled_schemes(self) -> typing.Optional[typing.Tuple[str, ...]]:
+        """
+        The URL schemes that :py:func:`handles_url` can possibly accept, as
+        determined by :py:func:`urllib.parse.urlparse`; ``''`` indicates an
+        address with no scheme (e.g. ``user@example.com`` or ``example.com``).
+
+        The :py:class:`authl.Authl` instance uses this to skip handlers which
+        can't handle a URL. ``None`` (the default) means that any URL might be
+        accepted.
+        """
+        return None
+
     def handles_page(self, url: str, headers, content, links) -> bool:
         """ Returns ``True``/truthy if we can handle the page based on page
         content
@@ -55,8 +68,12 @@ class Handler(ABC):
         :param str url: the canonicized identity URL
         :param dict headers: the raw headers from the page request, as a
             MultiDict (as provided by the `Requests`_ library)
-        :param bs4.BeautifulSoup content: the page content, as a
-            `BeautifulSoup4`_ parse tree
+        :param content: a function which returns the page content, as a
+            `BeautifulSoup4`_ parse tree. The page is only parsed the first
+            time this is called, so handlers that can decide based on the
+            headers or links should check those first. (This is a
+            :py:class:`authl.utils.LazyPage`, whose ``url`` is where the page
+            was finally retrieved from.)
         :param dict links: the results of parsing the Link: headers, as a
             dict of rel -> dict of 'url' and 'rel', as provided by the
             `Requests`_ library
@@ -12,9 +12,12 @@ See :py:func:`from_config` for the simplest configuration mechanism.
 """
 
 import email
+import functools
 import logging
 import math
+import string
 import time
+import typing
 import urllib.parse
 
 import expiringdict
@@ -25,6 +28,9 @@ from . import Handler
 
 LOGGER = logging.getLogger(__name__)
 
+# Placeholder for the login URL when prerendering the email template
+_URL_MARKER = '\0url\0'
+
 DEFAULT_TEMPLATE_TEXT = """\
 Hello! Someone, possibly you, asked to log in using this email address. If this
 was you, please visit the following link within the next {minutes} minutes:
@@ -36,6 +42,31 @@ If this wasn't you, you can safely disregard this message.
 """
 
 
+@functools.lru_cache(maxsize=1024)
+def _canonical_address(url: str) -> typing.Optional[str]:
+    """ Get the canonical ``mailto:`` URL for an email address, or ``None`` if
+    it isn't one """
+    url = url.lstrip()
+    if url[:7].lower() == 'mailto:':
+        address = url[7:]
+    elif ':' in url:
+        # some other URL scheme
+        return None
+    else:
+        address = url
+
+    # discard any query string or fragment
+    address = address.split('?', 1)[0].split('#', 1)[0].strip()
+
+    if ' ' in address or '!' in address:
+        return None
+
+    if validate_email.validate_email(address):
+        return 'mailto:' + address.lower()
+
+    return None
+
+
 class EmailAddress(Handler):
     """ Authenticate using a "magic link" sent via email.
 
@@ -69,6 +100,10 @@ class EmailAddress(Handler):
         return [('mailto:%', 'email@example.com'),
                 ('%', 'email@example.com')]
 
+    @property
+    def handled_schemes(self):
+        return ('', 'mailto')
+
     @property
     def description(self):
         return """Uses email to log you in, by sending a "magic link" to the
@@ -92,10 +127,24 @@ class EmailAddress(Handler):
                  ):
         # pylint:disable=too-many-arguments
         self._sendmail = sendmail
-        self._email_template_text = email_template_text
         self._cdata = notify_cdata
         self._token_store = token_store
         self._lifetime = expires_time or 900
+        minutes = int(math.ceil(self._lifetime / 60))
+
+        # Everything but the URL is known up front, so render the template now
+        # and just splice the URL in for each message. This isn't possible if
+        # the URL has formatting applied to it.
+        self._render_email: typing.Callable[[str], str]
+        if all(field == 'url' and not spec and not conversion
+               for _, field, spec, conversion in string.Formatter().parse(email_template_text)
+               if field and field.startswith('url')):
+            parts = email_template_text.format(url=_URL_MARKER,
+                                               minutes=minutes).split(_URL_MARKER)
+            self._render_email = lambda url: url.join(parts)
+        else:
+            self._render_email = lambda url: email_template_text.format(url=url,
+                                                                        minutes=minutes)
         self._pending = expiringdict.ExpiringDict(
             max_len=1024,
             max_age_seconds=self._lifetime) if pending_storage is None else pending_storage
@@ -106,20 +155,7 @@ class EmailAddress(Handler):
         ``mailto:user@example.com``. The actual address is validated using
         :py:mod:`validate_email`.
         """
-
-        parsed = urllib.parse.urlparse(url)
-        if parsed.scheme not in ('', 'mailto'):
-            return None
-
-        address = parsed.path.strip()
-
-        if ' ' in address or '!' in address:
-            return None
-
-        if validate_email.validate_email(address):
-            return 'mailto:' + address.lower()
-
-        return None
+        return _canonical_address(url)
 
     def initiate_auth(self, id_url, callback_uri, redir):
         parsed = urllib.parse.urlparse(id_url)
@@ -127,9 +163,10 @@ class EmailAddress(Handler):
             return disposition.Error("Malformed email URL", redir)
         dest_addr = parsed.path.lower()
 
-        if dest_addr in self._pending:
+        pending_token = self._pending.get(dest_addr)
+        if pending_token is not None:
             try:
-                _, _, when = self._token_store.get(self._pending[dest_addr])
+                _, _, when = self._token_store.get(pending_token)
                 if time.time() <= when + self._lifetime:
                     # There is already a pending valid token, so just remind them to
                     # check their email again
@@ -144,15 +181,12 @@ class EmailAddress(Handler):
         self._pending[dest_addr] = token
 
         link_url = (callback_uri + ('&' if '?' in callback_uri else '?') +
-                    urllib.parse.urlencode({'t': token}))
+                    't=' + urllib.parse.quote_plus(token))
 
         msg = email.message.EmailMessage()
         msg['To'] = dest_addr
 
-        msg.set_content(
-            self._email_template_text.format(
-                url=link_url, minutes=int(math.ceil(self._lifetime / 60)))
-        )
+        msg.set_content(self._render_email(link_url))
 
         self._sendmail(msg)
 
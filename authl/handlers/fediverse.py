@@ -16,8 +16,8 @@ import time
 import typing
 import urllib.parse
 
+import expiringdict
 import mastodon
-import requests
 
 from .. import disposition, tokens, utils
 from . import Handler
@@ -36,6 +36,10 @@ class Fediverse(Handler):
     def url_schemes(self):
         return [('https://%', 'instance/')]
 
+    @property
+    def handled_schemes(self):
+        return ('', 'http', 'https')
+
     @property
     def description(self):
         return """Identifies you using your choice of Fediverse instance
@@ -68,18 +72,25 @@ class Fediverse(Handler):
         self._token_store = token_store
         self._timeout = timeout or 600
 
-    @staticmethod
-    def _get_instance(url) -> typing.Optional[str]:
+        # Known instances, by domain, so that we don't have to probe them on
+        # every login
+        self._instances = expiringdict.ExpiringDict(max_len=1024, max_age_seconds=3600)
+
+    def _get_instance(self, url) -> typing.Optional[str]:
         parsed = urllib.parse.urlparse(url)
         if not parsed.netloc:
             parsed = urllib.parse.urlparse('https://' + url)
         domain = parsed.netloc
 
+        instance = self._instances.get(domain)
+        if instance:
+            return instance
+
         instance = 'https://' + domain
 
         try:
             LOGGER.debug("Trying Fediverse instance: %s", instance)
-            request = requests.get(instance + '/api/v1/instance')
+            request = utils.SESSION.get(instance + '/api/v1/instance', timeout=utils.TIMEOUT)
             if request.status_code != 200:
                 LOGGER.debug("Instance endpoint returned error %d", request.status_code)
                 return None
@@ -91,6 +102,7 @@ class Fediverse(Handler):
                     return None
 
             LOGGER.info("Found Fediverse instance: %s", instance)
+            self._instances[domain] = instance
             return instance
         except Exception as error:  # pylint:disable=broad-except
             LOGGER.debug("Fediverse probe failed: %s", error)
@@ -230,13 +242,13 @@ class Fediverse(Handler):
         # mastodon.py does not currently support the revoke endpoint; see
         # https://github.com/halcy/Mastodon.py/issues/217
         try:
-            request = requests.post(instance + '/oauth/revoke', data={
+            request = utils.SESSION.post(instance + '/oauth/revoke', data={
                 'client_id': client_id,
                 'client_secret': client_secret,
                 'token': access_token
             }, headers={
                 'Authorization': f'Bearer {access_token}'
-            })
+            }, timeout=utils.TIMEOUT)
             LOGGER.info("OAuth token revocation: %d %s",
                         request.status_code,
                         request.text)
@@ -17,15 +17,20 @@ whatever framework you're using. Please note also that the scheme (``http`` vs.
 
 """
 
+import concurrent.futures
+import functools
+import html
 import logging
+import re
 import time
 import typing
 import urllib.parse
+from urllib.parse import quote_plus
 
 import expiringdict
 import mf2py
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from .. import disposition, tokens, utils
 from . import Handler
@@ -36,65 +41,292 @@ LOGGER = logging.getLogger(__name__)
 # and find_endpoint can both benefit from the same endpoint cache
 _ENDPOINT_CACHE = expiringdict.ExpiringDict(max_len=128, max_age_seconds=1800)
 
+# Pages that were retrieved without finding an endpoint; these expire quickly
+# in case the page gets fixed
+_MISS_CACHE = expiringdict.ExpiringDict(max_len=512, max_age_seconds=300)
+
+# How long verify_id will wait for its endpoint lookups, in seconds
+VERIFY_TIMEOUT = 60
+
+# Origins which have rejected a HEAD request
+_NO_HEAD = expiringdict.ExpiringDict(max_len=256, max_age_seconds=3600)
+
 # And similar for retrieving user profiles
 _PROFILE_CACHE = expiringdict.ExpiringDict(max_len=128, max_age_seconds=1800)
 
+# Markup whose contents aren't tags as far as a parser is concerned (even if
+# they're unterminated), so a </head> or <link> within them doesn't count
+_OPAQUE = (rb'<!--.*?(?:-->|\Z)'
+           rb'|<(script|style|title|textarea|noscript|template)\b.*?(?:</\1\s*>|\Z)')
+_OPAQUE_RE = re.compile(_OPAQUE, re.I | re.S)
+_HEAD_END_RE = re.compile(_OPAQUE + rb'|(</head\s*>)', re.I | re.S)
+
+# For finding <link> tags without building a parse tree
+_LINK_TAG_RE = re.compile(rb'<link\s([^>]*)>', re.I)
+_ATTR_RE = re.compile(rb'''([^\s=/>]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''')
+
+# Endpoint discovery only cares about <link rel> elements, so don't build a
+# tree for anything else. (The rel value itself is checked after parsing, as
+# bs4 doesn't match multi-valued attributes while straining.)
+_LINK_STRAINER = SoupStrainer('link', attrs={'rel': True})
+
+
+def _find_head_end(content: typing.Union[bytes, bytearray]) -> typing.Optional[int]:
+    """ Find the end of the closing </head> tag in an HTML document, if any """
+    for match in _HEAD_END_RE.finditer(content):
+        if match.group(2):
+            return match.end()
+    return None
+
+
+def _get_head(content: bytes) -> bytes:
+    """ Get the portion of an HTML document up to the end of its <head> """
+    return content[:_find_head_end(content)]
+
+
+def _parse_links(content: bytes) -> BeautifulSoup:
+    """ Parse just the <link> elements out of an HTML document's <head> """
+    return BeautifulSoup(_get_head(content), utils.HTML_PARSER, parse_only=_LINK_STRAINER)
+
+
+def _scan_links(content: bytes, rel: str) -> typing.Optional[str]:
+    """ Look for a <link> with the given rel in an HTML document's <head>,
+    without parsing the document.
+
+    :returns: the first matching href (unresolved), or ``None`` if there
+        wasn't an obvious match; in that case the document should still be
+        parsed properly.
+    """
+    head = _OPAQUE_RE.sub(b'', _get_head(content))
+    for tag in _LINK_TAG_RE.finditer(head):
+        attrs = {name.lower(): b''.join(value)
+                 for name, *value in _ATTR_RE.findall(tag.group(1))}
+        if rel.encode() in attrs.get(b'rel', b'').lower().split() and b'href' in attrs:
+            try:
+                return html.unescape(attrs[b'href'].decode('utf-8'))
+            except UnicodeDecodeError:
+                return None
+    return None
+
+
+def _read_page(request: requests.Response,
+               check_head: typing.Callable[[bytes], typing.Any]
+               ) -> typing.Tuple[bytes, typing.Any]:
+    """ Read the body of a streamed page request.
+
+    Once the end of the document's ``<head>`` has been read, it is passed to
+    ``check_head``; if that returns something falsy, there's nothing else we
+    need from the page, so the rest of it is left unretrieved. If there's no
+    distinct ``<head>``, the whole page gets checked instead.
+
+    :returns: a tuple of ``(body, check_result)``
+    """
+    body = bytearray()
+    checked, result = False, None
+    with request:
+        for chunk in utils.iter_body(request):
+            body += chunk
+            if not checked:
+                # rescan from the start, as a chunk might end partway through
+                # a comment or script
+                head_end = _find_head_end(body)
+                if head_end:
+                    checked = True
+                    result = check_head(bytes(body[:head_end]))
+                    if not result:
+                        LOGGER.debug("%s: Nothing useful in <head>; not reading further",
+                                     request.url)
+                        break
+    if not checked:
+        result = check_head(bytes(body))
+    return bytes(body), result
+
+
+def _head_links(url: str) -> typing.Tuple[typing.Optional[dict], str]:
+    """ Get the Link headers for a URL without retrieving its body.
+
+    :returns: a tuple of ``(links, permanent_url)``; the links are ``None``
+        if the HEAD request didn't work
+    """
+    origin = urllib.parse.urlparse(utils.cache_key(url))[:2]
+    if origin in _NO_HEAD:
+        return None, url
+
+    try:
+        response = utils.SESSION.head(url, allow_redirects=True, timeout=utils.TIMEOUT)
+    except Exception as err:  # pylint:disable=broad-except
+        LOGGER.info("HEAD %s failed: %s", url, err)
+        return None, url
+
+    if response.status_code in (405, 501):
+        LOGGER.debug("%s doesn't support HEAD", origin)
+        _NO_HEAD[origin] = True
+    if not 200 <= response.status_code < 300:
+        return None, url
+
+    return response.links, utils.permanent_url(response)
+
+
+def _link_endpoint(links: typing.Optional[dict]) -> typing.Optional[str]:
+    """ Find the endpoint in a page's Link headers """
+    if links and 'authorization_endpoint' in links:
+        LOGGER.debug("Found link header")
+        return links['authorization_endpoint']['url']
+    return None
+
+
+def _tree_endpoint(tree: BeautifulSoup, base_url: str) -> typing.Optional[str]:
+    """ Find the endpoint in a parsed page """
+    # Only look in the <head> (when there is one), the same as when we
+    # retrieve the page ourselves
+    link = (tree.head or tree).find('link', rel='authorization_endpoint', href=True)
+    if link:
+        LOGGER.debug("Found link tag")
+        return urllib.parse.urljoin(base_url, str(link.get('href')))
+    return None
+
+
+def _page_endpoint(page: bytes, base_url: str) -> typing.Optional[str]:
+    """ Find the endpoint in an unparsed page, or just its <head> """
+    # Most pages are simple enough to not need a parse tree
+    href = _scan_links(page, 'authorization_endpoint')
+    if href:
+        LOGGER.debug("Found link tag by scan")
+        return urllib.parse.urljoin(base_url, href)
+    return _tree_endpoint(_parse_links(page), base_url)
+
+
+def _content_endpoint(content: typing.Union[BeautifulSoup, utils.LazyPage],
+                      id_url: str) -> typing.Optional[str]:
+    """ Find the endpoint in page content that the caller already retrieved """
+    if isinstance(content, utils.LazyPage):
+        if content.parsed:
+            return _tree_endpoint(content(), content.url)
+        # Check it the same way as if we'd retrieved it ourselves, which
+        # usually means not having to parse it at all
+        return _page_endpoint(content.content, content.url)
+    return _tree_endpoint(content, id_url)
+
+
+def _parsed_content(content) -> typing.Optional[BeautifulSoup]:
+    """ Get the parse tree of page content, but only if it's already been built """
+    if isinstance(content, utils.LazyPage):
+        return content() if content.parsed else None
+    if isinstance(content, BeautifulSoup):
+        return content
+    return None
+
+
+def _store_endpoint(cache: dict, miss_cache: dict, id_url: str, found: str, profile: str):
+    """ Remember an endpoint for both the identity and profile URLs """
+    LOGGER.debug("Caching %s -> %s", id_url, found)
+    cache[utils.cache_key(id_url)] = (found, profile)
+    cache[utils.cache_key(profile)] = (found, profile)
+    miss_cache.pop(utils.cache_key(id_url), None)
+
+
+def _retrieve_endpoint(id_url: str, cache: dict, miss_cache: dict,
+                       headers_only: bool) -> typing.Tuple[typing.Optional[str], str]:
+    """ Retrieve an identity page to find its endpoint, and cache the result """
+    if headers_only:
+        links, profile = _head_links(id_url)
+        found = _link_endpoint(links)
+        if found:
+            _store_endpoint(cache, miss_cache, id_url, found, profile)
+            return found, profile
+
+    LOGGER.debug("Retrieving %s", id_url)
+    found, profile, content = None, id_url, None
+    request = utils.request_url(id_url, stream=True)
+    if request is not None:
+        # The endpoint has to be in either the headers or the <head>; we only
+        # need the rest of the page for prefilling the profile
+        from_header = _link_endpoint(request.links)
+        content, found = _read_page(
+            request, lambda head: from_header or _page_endpoint(head, request.url))
+        profile = utils.permanent_url(request)
+
+    if found:
+        _store_endpoint(cache, miss_cache, id_url, found, profile)
+        # Let's also prefill the profile, while we're here
+        if content:
+            get_profile(profile, content)
+    elif request is not None and 200 <= request.status_code < 300:
+        # Only remember pages that actually lacked an endpoint, rather than
+        # ones which failed to load (which might be temporary)
+        miss_cache[utils.cache_key(id_url)] = True
+    return found, profile
+
 
 def find_endpoint(id_url: str,
                   links: typing.Dict = None,
-                  content: BeautifulSoup = None) -> typing.Tuple[typing.Optional[str],
-                                                                 str]:
+                  content: typing.Union[BeautifulSoup,
+                                        typing.Callable[[], BeautifulSoup], None] = None,
+                  cache: dict = None,
+                  miss_cache: dict = None,
+                  headers_only: bool = False) -> typing.Tuple[typing.Optional[str], str]:
     """ Given an identity URL, discover its IndieAuth endpoint
 
     :param str id_url: an identity URL to check
     :param links: a request.links object from a requests operation
-    :param BeautifulSoup content: a BeautifulSoup parse tree of an HTML document
+    :param content: a BeautifulSoup parse tree of an HTML document, or a
+        function that returns one; if it's a :py:class:`authl.utils.LazyPage`,
+        it's only parsed if it has to be, and relative links are resolved
+        against its final URL rather than ``id_url``
+    :param dict cache: a dict-like object for caching discovered endpoints;
+        defaults to a process-local ExpiringDict
+    :param dict miss_cache: a dict-like object for remembering pages that
+        had no endpoint; defaults to a process-local ExpiringDict
+    :param bool headers_only: if the page has to be retrieved, first try
+        finding the endpoint with a HEAD request; this avoids downloading the
+        page when the caller doesn't need its profile
 
     :returns: a tuple of ``(endpoint_url, profile_url)``
     """
-    profile = id_url
-
-    def _derive_endpoint(links, content) -> typing.Optional[str]:
-        LOGGER.debug('links for %s: %s', id_url, links)
-        if links and 'authorization_endpoint' in links:
-            LOGGER.debug("Found link header")
-            return links['authorization_endpoint']['url']
-
-        if content:
-            link = content.find('link', rel='authorization_endpoint')
-            if link:
-                LOGGER.debug("Found link tag")
-                return urllib.parse.urljoin(id_url, link.get('href'))
-
-        return None
+    # pylint:disable=too-many-arguments
+    if cache is None:
+        cache = _ENDPOINT_CACHE
+    if miss_cache is None:
+        miss_cache = _MISS_CACHE
+    key = utils.cache_key(id_url)
 
     # Get the cached endpoint value, but don't immediately use it if we have
     # links and/or content, as it might have changed
-    cached, profile = _ENDPOINT_CACHE.get(id_url, (None, profile))
+    cached, profile = cache.get(key, (None, id_url))
     LOGGER.debug("Cached endpoint for %s: %s %s", id_url, cached, profile)
 
-    found = (links or content) and _derive_endpoint(links, content)
-    if id_url and not found and not cached:
-        # We didn't find a new endpoint, and we didn't have a cached one
-        LOGGER.debug("Retrieving %s", id_url)
-        request = utils.request_url(id_url)
-        if request is not None:
-            links = request.links
-            content = BeautifulSoup(request.text, 'html.parser')
-            found = _derive_endpoint(links, content)
-            profile = utils.permanent_url(request)
-
-    if found and id_url:
-        # we found a new value so update the cache
-        LOGGER.debug("Caching %s -> %s", id_url, found)
-        _ENDPOINT_CACHE[id_url] = (found, profile)
-        _ENDPOINT_CACHE[profile] = (found, profile)
-
-        # Let's also prefill the profile, while we're here
-        if content:
-            get_profile(profile, content)
-
-    return (found or cached), profile
+    if links or content:
+        # The caller already retrieved the page, so don't retrieve it again
+        LOGGER.debug('links for %s: %s', id_url, links)
+        found = _link_endpoint(links)
+        if not found and content:
+            # (BeautifulSoup trees are callable themselves, as a find_all shortcut)
+            if callable(content) and not isinstance(content, (BeautifulSoup, utils.LazyPage)):
+                content = content()
+            found = _content_endpoint(content, id_url)
+        if found and id_url:
+            _store_endpoint(cache, miss_cache, id_url, found, profile)
+            # Prefill the profile if the page has already been parsed; otherwise
+            # it's cheaper to wait and see if the login actually completes
+            tree = _parsed_content(content)
+            if tree is not None:
+                get_profile(profile, tree)
+        return (found or cached), profile
+
+    if cached:
+        # There's nothing new to go on, so a cached result is the answer
+        return cached, profile
+    if key in miss_cache:
+        LOGGER.debug("%s recently had no endpoint", id_url)
+        return None, profile
+    if not id_url:
+        return None, profile
+
+    # Go get the page; simultaneous lookups of the same page (into the same
+    # caches) can share the retrieval
+    return utils.single_flight(('find_endpoint', key, id(cache), id(miss_cache), headers_only),
+                               lambda: _retrieve_endpoint(id_url, cache, miss_cache,
+                                                          headers_only))
 
 
 def _parse_hcard(id_url, card):
@@ -129,13 +361,20 @@ def _parse_hcard(id_url, card):
     }
 
 
-def get_profile(id_url: str, content: BeautifulSoup = None) -> dict:
-    """ Given an identity URL, try to parse out an Authl profile """
+def get_profile(id_url: str,
+                content: typing.Union[BeautifulSoup, bytes, str, None] = None) -> dict:
+    """ Given an identity URL, try to parse out an Authl profile
+
+    :param str id_url: the identity URL
+    :param content: the page content, as either a BeautifulSoup parse tree or
+        the raw document
+    """
     if content:
         h_cards = mf2py.Parser(doc=content).to_dict(filter_by_type="h-card")
-    elif id_url in _PROFILE_CACHE:
-        return _PROFILE_CACHE[id_url]
     else:
+        cached = _PROFILE_CACHE.get(id_url)
+        if cached is not None:
+            return cached
         h_cards = mf2py.Parser(url=id_url).to_dict(filter_by_type="h-card")
 
     profile = {}
@@ -148,7 +387,8 @@ def get_profile(id_url: str, content: BeautifulSoup = None) -> dict:
     return profile
 
 
-def verify_id(request_id: str, response_id: str) -> str:
+def verify_id(request_id: str, response_id: str,
+              cache: dict = None, miss_cache: dict = None) -> str:
     """
 
     Given an ID from an identity request and its verification response, ensure
@@ -157,17 +397,28 @@ def verify_id(request_id: str, response_id: str) -> str:
 
     :param str request_id: The original requested identity
     :param str response_id: The authorized response identity
+    :param dict cache: the endpoint cache to use for :py:func:`find_endpoint`
+    :param dict miss_cache: the miss cache to use for :py:func:`find_endpoint`
 
     :returns: the verified response ID
     :raises: :py:class:`ValueError` if verification failed
     """
 
-    # exact match is always okay
-    if request_id == response_id:
+    # exact match is always okay, as is one that only differs by host case or
+    # fragment
+    if request_id == response_id or utils.cache_key(request_id) == utils.cache_key(response_id):
         return response_id
 
-    req_endpoint, _ = find_endpoint(request_id)
-    resp_endpoint, resp_profile = find_endpoint(response_id)
+    # The two lookups are independent, so they can happen at the same time.
+    # (We don't need the original page's profile, only its endpoint.)
+    lookups = (functools.partial(find_endpoint, request_id, cache=cache, miss_cache=miss_cache,
+                                 headers_only=True),
+               functools.partial(find_endpoint, response_id, cache=cache, miss_cache=miss_cache))
+    try:
+        (req_endpoint, _), (resp_endpoint, resp_profile) = utils.concurrent_map(
+            lambda lookup: lookup(), lookups, VERIFY_TIMEOUT)
+    except concurrent.futures.TimeoutError as err:
+        raise ValueError(f'Timed out verifying {response_id}') from err
 
     if resp_endpoint is None:
         raise ValueError(f'Profile {resp_profile} missing IndieAuth endpoint')
@@ -180,6 +431,15 @@ def verify_id(request_id: str, response_id: str) -> str:
     return resp_profile
 
 
+class _Pending(typing.NamedTuple):
+    """ A login transaction that's waiting for its callback """
+    id_url: str
+    endpoint: str
+    callback_uri: str
+    when: float
+    redir: str
+
+
 class IndieAuth(Handler):
     """ Supports login via IndieAuth.
 
@@ -200,6 +460,10 @@ class IndieAuth(Handler):
         # pylint:disable=duplicate-code
         return [('%', 'https://domain.example.com')]
 
+    @property
+    def handled_schemes(self):
+        return ('', 'http', 'https')
+
     @property
     def description(self):
         return """Supports login via an
@@ -214,7 +478,9 @@ class IndieAuth(Handler):
         return [(utils.read_icon('indieauth.svg'), 'IndieAuth')]
 
     def __init__(self, client_id: typing.Union[str, typing.Callable[..., str]],
-                 token_store: tokens.TokenStore, timeout: int = None):
+                 token_store: tokens.TokenStore, timeout: int = None,
+                 endpoint_cache: dict = None,
+                 miss_cache: dict = None):
         """
         :param client_id: The client_id to send to the remote IndieAuth
             provider. Can be a string or a function that returns a string.
@@ -224,11 +490,37 @@ class IndieAuth(Handler):
         :param int timeout: Maximum time to wait for login to complete
             (default: 600)
 
+        :param dict endpoint_cache: dict-like storage for discovered
+            endpoints. Defaults to a process-local cache; providing a shared
+            store (e.g. one backed by Redis) lets multiple worker processes
+            share discovery results.
+
+        :param dict miss_cache: dict-like storage for remembering pages which
+            had no endpoint, so that repeated attempts don't keep retrieving
+            them. Entries should expire fairly quickly. Defaults to a
+            process-local cache.
+
         """
+        # pylint:disable=too-many-arguments
 
         self._client_id = client_id
+        # Most configurations use a fixed client ID, so don't re-resolve it
+        # on every request
+        self._static_client_id = None if callable(client_id) else client_id
+        # The authorization URL parameters which are the same for every login
+        fixed_params = {'response_type': 'code', 'scope': 'profile'}
+        if self._static_client_id is not None:
+            fixed_params['client_id'] = self._static_client_id
+        self._fixed_query = urllib.parse.urlencode(fixed_params)
         self._token_store = token_store
         self._timeout = timeout or 600
+        self._endpoints = _ENDPOINT_CACHE if endpoint_cache is None else endpoint_cache
+        self._misses = _MISS_CACHE if miss_cache is None else miss_cache
+
+    def _get_client_id(self) -> str:
+        if self._static_client_id is not None:
+            return self._static_client_id
+        return utils.resolve_value(self._client_id)
 
     def handles_url(self, url):
         """
@@ -236,31 +528,33 @@ class IndieAuth(Handler):
         that; otherwise this returns ``None`` so the Authl instance falls
         through to :py:func:`handles_page`.
         """
-        if url in _ENDPOINT_CACHE:
-            return _ENDPOINT_CACHE[url][1]
-        return None
+        cached = self._endpoints.get(utils.cache_key(url))
+        return cached[1] if cached else None
 
     def handles_page(self, url, headers, content, links):
         """ :returns: whether an ``authorization_endpoint`` was found on the page. """
-        return find_endpoint(url, links, content)[0] is not None
+        return find_endpoint(url, links, content,
+                             self._endpoints, self._misses)[0] is not None
 
     def initiate_auth(self, id_url, callback_uri, redir):
-        endpoint, id_url = find_endpoint(id_url)
+        endpoint, id_url = find_endpoint(id_url, cache=self._endpoints,
+                                         miss_cache=self._misses)
         if not endpoint:
             return disposition.Error("Failed to get IndieAuth endpoint", redir)
 
-        state = self._token_store.put((id_url, endpoint, callback_uri, time.time(), redir))
+        state = self._token_store.put(_Pending(id_url, endpoint, callback_uri, time.time(), redir))
 
-        client_id = utils.resolve_value(self._client_id)
-        LOGGER.debug("Using client_id %s", client_id)
+        query = self._fixed_query
+        if self._static_client_id is None:
+            client_id = utils.resolve_value(self._client_id)
+            LOGGER.debug("Using client_id %s", client_id)
+            query += f'&client_id={quote_plus(client_id)}'
 
-        url = endpoint + '?' + urllib.parse.urlencode({
-            'redirect_uri': callback_uri,
-            'client_id': client_id,
-            'state': state,
-            'response_type': 'code',
-            'scope': 'profile',
-            'me': id_url})
+        # The endpoint is allowed to have its own query parameters
+        url = (f"{endpoint}{'&' if '?' in endpoint else '?'}{query}"
+               f'&redirect_uri={quote_plus(callback_uri)}'
+               f'&state={quote_plus(state)}'
+               f'&me={quote_plus(id_url)}')
         return disposition.Redirect(url)
 
     def check_callback(self, url, get, data):
@@ -271,41 +565,48 @@ class IndieAuth(Handler):
             return disposition.Error("No transaction provided", '')
 
         try:
-            id_url, endpoint, callback_uri, when, redir = self._token_store.pop(state)
-        except (KeyError, ValueError):
+            pending = self._token_store.pop(state, _Pending._make)
+        except (KeyError, TypeError, ValueError):
             return disposition.Error("Invalid token", '')
 
-        if time.time() > when + self._timeout:
-            return disposition.Error("Transaction timed out", redir)
+        if time.time() > pending.when + self._timeout:
+            return disposition.Error("Transaction timed out", pending.redir)
 
         try:
             # Verify the auth code
-            request = requests.post(endpoint, data={
+            request = utils.SESSION.post(pending.endpoint, data={
                 'code': get['code'],
-                'client_id': utils.resolve_value(self._client_id),
-                'redirect_uri': callback_uri
-            }, headers={'accept': 'application/json'})
+                'client_id': self._get_client_id(),
+                'redirect_uri': pending.callback_uri
+            }, headers={'accept': 'application/json'}, timeout=utils.TIMEOUT)
 
             if request.status_code != 200:
                 LOGGER.error("Request returned code %d: %s", request.status_code, request.text)
                 return disposition.Error("Authorization endpoint returned %d" % request.status_code,
-                                         redir)
+                                         pending.redir)
 
             try:
-                response = request.json()
+                response = utils.parse_json(request.content)
             except ValueError:
                 LOGGER.error("%s: Got invalid JSON response from %s: %s (content-type: %s)",
-                             id_url, endpoint,
+                             pending.id_url, pending.endpoint,
                              request.text,
                              request.headers.get('content-type'))
-                return disposition.Error("Got invalid response JSON", redir)
+                return disposition.Error("Got invalid response JSON", pending.redir)
 
-            response_id = verify_id(id_url, response['me'])
-            return disposition.Verified(response_id, redir, get_profile(response_id))
+            response_id = verify_id(pending.id_url, response['me'], self._endpoints, self._misses)
+            return disposition.Verified(response_id, pending.redir, get_profile(response_id))
         except KeyError as key:
-            return disposition.Error("Missing " + str(key), redir)
+            return disposition.Error("Missing " + str(key), pending.redir)
         except ValueError as err:
-            return disposition.Error(str(err), redir)
+            return disposition.Error(str(err), pending.redir)
+        except requests.Timeout:
+            LOGGER.warning("%s: Timed out verifying with %s", pending.id_url, pending.endpoint)
+            return disposition.Error("Authorization endpoint timed out", pending.redir)
+        except requests.RequestException as err:
+            LOGGER.warning("%s: Error verifying with %s: %s",
+                           pending.id_url, pending.endpoint, err)
+            return disposition.Error("Could not reach authorization endpoint", pending.redir)
 
 
 def from_config(config, token_store):
@@ -315,7 +616,21 @@ def from_config(config, token_store):
 
     * ``INDIEAUTH_CLIENT_ID``: the client ID (URL) of your website (required)
     * ``INDIEAUTH_PENDING_TTL``: timemout for a pending transction
+    * ``INDIEAUTH_ENDPOINT_CACHE``: dict-like storage for discovered endpoints,
+      for sharing them between processes
+    * ``INDIEAUTH_MISS_TTL``: how long to remember that a page had no
+      endpoint, in seconds (default: 300)
+    * ``INDIEAUTH_MAX_MISSES``: how many endpoint-less pages to remember
+      (default: 512)
     """
+    miss_cache = None
+    if 'INDIEAUTH_MISS_TTL' in config or 'INDIEAUTH_MAX_MISSES' in config:
+        miss_cache = expiringdict.ExpiringDict(
+            max_len=config.get('INDIEAUTH_MAX_MISSES', 512),
+            max_age_seconds=config.get('INDIEAUTH_MISS_TTL', 300))
+
     return IndieAuth(config['INDIEAUTH_CLIENT_ID'],
                      token_store,
-                     timeout=config.get('INDIEAUTH_PENDING_TTL'))
+                     timeout=config.get('INDIEAUTH_PENDING_TTL'),
+                     endpoint_cache=config.get('INDIEAUTH_ENDPOINT_CACHE'),
+                     miss_cache=miss_cache)
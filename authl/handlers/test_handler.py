@@ -44,6 +44,10 @@ class TestHandler(Handler):
     def service_name(self):
         return 'Loopback'
 
+    @property
+    def handled_schemes(self):
+        return ('test',)
+
     @property
     def url_schemes(self):
         return [('test:%', 'example')]
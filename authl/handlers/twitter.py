@@ -62,6 +62,10 @@ class Twitter(Handler):
     def url_schemes(self):
         return [('https://twitter.com/%', 'username')]
 
+    @property
+    def handled_schemes(self):
+        return ('', 'http', 'https')
+
     @property
     def logo_html(self):
         return [(utils.read_icon("twitter.svg"), 'Twitter')]
@@ -124,14 +128,12 @@ class Twitter(Handler):
             return disposition.Error(err, redir)
 
     def check_callback(self, url, get, data):
-        if 'denied' in get:
-            token = get['denied']
-        elif 'oauth_token' in get:
-            token = get['oauth_token']
-        if not token or token not in self._pending:
+        token = get.get('denied', get.get('oauth_token'))
+        pending = self._pending.pop(token, None) if token else None
+        if not pending:
             return disposition.Error("Invalid transaction", '')
 
-        secret, callback_uri, redir, start_time = self._pending.pop(token)
+        secret, callback_uri, redir, start_time = pending
 
         if time.time() > start_time + self._timeout:
             return disposition.Error("Login timed out", redir)
@@ -1,14 +1,71 @@
 """ Utility functions """
 
+import collections
+import concurrent.futures
+import contextvars
+import http.cookiejar
+import importlib.util
+import itertools
 import logging
 import os.path
+import threading
 import typing
 import urllib.parse
 
 import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads  # type:ignore
+
+
+def _html_parser() -> str:
+    """ Pick the fastest BeautifulSoup tree builder that's available """
+    return 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+
+HTML_PARSER = _html_parser()
 
 LOGGER = logging.getLogger(__name__)
 
+# Limits on how much of a retrieved page we're willing to process
+MAX_BODY_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+
+# (connect, read) timeout for outgoing requests
+TIMEOUT = (3.05, 10)
+
+# Shared HTTP session, so that repeated requests to the same host can reuse
+# connections instead of paying for a new TCP+TLS handshake every time.
+# Neither failed connections nor failed reads are retried, so a request never
+# waits longer than TIMEOUT; urllib3 already checks that a pooled connection
+# is still alive before reusing it.
+SESSION = requests.Session()
+for _scheme in ('https://', 'http://'):
+    SESSION.mount(_scheme, HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                                       max_retries=Retry(total=2, connect=0, read=0,
+                                                         backoff_factor=0.1)))
+# Cookies from one user's identity lookups must not leak into another's
+SESSION.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+# Nobody's identity URL legitimately needs more redirections than this
+SESSION.max_redirects = 5
+
+# Shared pool for running independent network lookups side-by-side
+_POOL_THREAD = threading.local()
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=8,
+    thread_name_prefix='authl',
+    initializer=lambda: setattr(_POOL_THREAD, 'active', True))
+
+# How many of the pool's threads a single concurrent_map may occupy at once,
+# so that one caller's fan-out can't hold up everyone else's lookups
+MAX_FANOUT = 4
+
 
 def read_file(filename):
     """ Given a filename, read the entire thing into a string """
@@ -21,13 +78,57 @@ def read_icon(filename):
     return read_file(os.path.join(os.path.dirname(__file__), 'icons', filename))
 
 
-def request_url(url: str) -> typing.Optional[requests.Response]:
-    """ Requests a URL, attempting to canonicize it as it goes """
+def iter_body(response: requests.Response,
+              max_size: int = None,
+              content_types: typing.Optional[typing.Collection[str]] = HTML_TYPES
+              ) -> typing.Iterator[bytes]:
+    """ Iterate over the body of a streamed response, in chunks of
+    :py:data:`CHUNK_SIZE`.
+
+    :param response: The streamed response
+    :param int max_size: The maximum number of bytes to read (default:
+        :py:data:`MAX_BODY_SIZE`)
+    :param content_types: The content types which will be read, or ``None``
+        to read any type; documents with no declared type are always read
+    """
+    content_type = response.headers.get('Content-Type')
+    if (content_types is not None and content_type
+            and content_type.split(';')[0].strip().lower() not in content_types):
+        LOGGER.info("%s: not reading content of type %s", response.url, content_type)
+        return
+
+    max_size = max_size or MAX_BODY_SIZE
+    remaining = max_size
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        yield chunk[:remaining]
+        remaining -= len(chunk)
+        if remaining <= 0:
+            LOGGER.info("%s: truncating content at %d bytes", response.url, max_size)
+            return
+
+
+def request_url(url: str, stream: bool = False,
+                **kwargs) -> typing.Optional[requests.Response]:
+    """ Requests a URL, attempting to canonicize it as it goes
+
+    :param str url: The URL to request
+    :param bool stream: Whether to leave the response body unread, for the
+        caller to retrieve with :py:func:`iter_body`. Otherwise the body is
+        read as per :py:func:`iter_body`.
+    :param kwargs: Additional arguments to pass along to :py:func:`requests.get`;
+        the timeout defaults to :py:data:`TIMEOUT`
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
 
     for prefix in ('', 'https://', 'http://'):
         attempt = prefix + url
         try:
-            return requests.get(attempt)
+            response = SESSION.get(attempt, stream=True, **kwargs)
+            if not stream:
+                with response:
+                    # pylint:disable=protected-access
+                    response._content = b''.join(iter_body(response))
+            return response
         except requests.exceptions.MissingSchema:
             LOGGER.info("Missing schema on URL %s", attempt)
         except Exception as err:  # pylint:disable=broad-except
@@ -36,6 +137,112 @@ def request_url(url: str) -> typing.Optional[requests.Response]:
     return None
 
 
+class LazyPage:
+    """ The content of a retrieved page, which only gets parsed the first time
+    it's called for
+
+    :param requests.Response response: the (fully-read) response for the page
+    """
+    # pylint:disable=too-few-public-methods
+
+    def __init__(self, response: requests.Response):
+        #: The URL the page was finally retrieved from, after any redirections;
+        #: relative links on the page are relative to this
+        self.url = response.url
+        #: The raw page content
+        self.content = response.content
+        self._tree: typing.Optional[BeautifulSoup] = None
+
+    @property
+    def parsed(self) -> bool:
+        """ Whether the page has been parsed yet """
+        return self._tree is not None
+
+    def __call__(self) -> BeautifulSoup:
+        if self._tree is None:
+            self._tree = BeautifulSoup(self.content, HTML_PARSER)
+        return self._tree
+
+
+def concurrent_map(func: typing.Callable, items: typing.Iterable,
+                   timeout: float = None) -> typing.Iterator:
+    """ Like :py:func:`map`, but the calls run concurrently on a shared thread
+    pool; results are still yielded in order. Each call runs in a copy of the
+    caller's :py:mod:`contextvars` context.
+
+    At most :py:data:`MAX_FANOUT` of the calls are in the pool at a time, and
+    any that haven't started yet are cancelled if the caller stops consuming
+    the results early.
+
+    When called from one of the pool's own threads, the calls run in that
+    thread instead; otherwise nested calls could end up waiting on work that
+    is queued behind them, and deadlock the pool.
+
+    :param timeout: how long to wait for each result, in seconds; if exceeded,
+        :py:class:`concurrent.futures.TimeoutError` is raised
+    """
+    items = list(items)
+    if len(items) < 2 or getattr(_POOL_THREAD, 'active', False):
+        return map(func, items)
+
+    pending = iter(items)
+
+    def submit(item):
+        return _EXECUTOR.submit(contextvars.copy_context().run, func, item)
+
+    futures = collections.deque(submit(item) for item in itertools.islice(pending, MAX_FANOUT))
+
+    def results():
+        try:
+            while futures:
+                result = futures.popleft().result(timeout)
+                futures.extend(submit(item) for item in itertools.islice(pending, 1))
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return results()
+
+
+# Lookups that are currently in progress, for single_flight
+_INFLIGHT: typing.Dict[typing.Hashable, concurrent.futures.Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def single_flight(key: typing.Hashable, func: typing.Callable[[], typing.Any]):
+    """ Call ``func()``, unless another thread is already doing so for the
+    same key, in which case wait for that call to finish and share its result
+    (or exception). The key should be namespaced by the caller. """
+    future: concurrent.futures.Future = concurrent.futures.Future()
+    with _INFLIGHT_LOCK:
+        existing = _INFLIGHT.setdefault(key, future)
+
+    if existing is not future:
+        return existing.result()
+
+    try:
+        result = func()
+        future.set_result(result)
+        return result
+    except BaseException as err:
+        future.set_exception(err)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+
+
+def parse_json(data: typing.Union[bytes, str]) -> typing.Any:
+    """ Decode a JSON document, using `orjson`_ if it's installed.
+
+    Raises :py:class:`ValueError` if the document is malformed.
+
+    .. _orjson: https://pypi.org/project/orjson/
+    """
+    return _json_loads(data)
+
+
 def resolve_value(val):
     """ if given a callable, call it; otherwise, return it """
     if callable(val):
@@ -43,6 +250,28 @@ def resolve_value(val):
     return val
 
 
+_DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+def cache_key(url: str) -> str:
+    """ Normalize a URL for use as a cache key, by lowercasing the scheme and
+    host, removing any default port and fragment, and making an empty path
+    into ``/`` """
+    try:
+        parsed = urllib.parse.urlparse(url)
+    except ValueError:
+        return url
+
+    netloc = parsed.netloc.lower()
+    default_port = _DEFAULT_PORTS.get(parsed.scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+
+    return urllib.parse.urlunparse(parsed._replace(netloc=netloc,
+                                                   path=parsed.path or (netloc and '/'),
+                                                   fragment=''))
+
+
 def permanent_url(response: requests.Response) -> str:
     """ Given a requests.Response object, determine what the permanent URL
     for it is from the response history """
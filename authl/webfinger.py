@@ -3,50 +3,137 @@ Webfinger utility
 =================
 """
 
-import html
 import logging
 import re
 import typing
+import urllib.parse
 
+import expiringdict
 import requests
+import urllib3
+
+from . import utils
 
 LOGGER = logging.getLogger(__name__)
 
+# Profile lookups rarely change, so they can be kept for quite a while
+_PROFILE_CACHE = expiringdict.ExpiringDict(max_len=4096, max_age_seconds=30 * 3600)
+
+# Servers which sent back a broken response, and the fallback that was used
+_MALFORMED = expiringdict.ExpiringDict(max_len=1024, max_age_seconds=300)
+
+# A WebFinger document is a short list of links; anything much larger than
+# this isn't one
+MAX_RESPONSE_SIZE = 128 * 1024
+
+# Each profile gets probed, so only this many of them (in document order) are
+# worth considering
+MAX_PROFILES = 8
+
+# The link relations which point to a user's profile page
+_PROFILE_RELS = frozenset(('http://webfinger.net/rel/profile-page', 'profile', 'self'))
+
+# @user@domain, where the domain has to be a bare hostname; anything else would
+# just get us an error from (or on the way to) the server
+_WEBFINGER_RE = re.compile(r'@([^@/\s?#]+)@([A-Za-z0-9.\-]+)\Z')
+
 
-def get_profiles(url: str) -> typing.Set[str]:
+def get_profiles(url: str, cache: dict = None) -> typing.Set[str]:
     """
 
     Get the potential identity URLs from a webfinger address.
 
     :param str url: The webfinger URL
+    :param dict cache: a dict-like object for caching the lookup results;
+        defaults to a process-local ExpiringDict
 
     :returns: A :py:type:`set` of potential identity URLs
 
     """
-    webfinger = re.match(r'@([^@]+)@(.*)$', url)
+    webfinger = _WEBFINGER_RE.match(url)
     if not webfinger:
         return set()
 
+    if cache is None:
+        cache = _PROFILE_CACHE
+
+    user, domain = webfinger.group(1, 2)
+    LOGGER.debug("webfinger: user=%s domain=%s", user, domain)
+
+    key = f'acct:{user}@{domain.lower()}'
+    cached = cache.get(key)
+    if cached is None:
+        cached = _MALFORMED.get(key)
+    if cached is not None:
+        LOGGER.debug("Cached profiles for %s: %s", key, cached)
+        return set(cached)
+
+    # Simultaneous lookups of the same address can share one request
+    return set(utils.single_flight(('webfinger', key),
+                                   lambda: _lookup(user, domain, key, cache)))
+
+
+def get_profiles_batch(urls: typing.Iterable[str],
+                       cache: dict = None) -> typing.Dict[str, typing.Set[str]]:
+    """
+
+    Get the potential identity URLs for several webfinger addresses at once.
+    The lookups run concurrently, and share connections to the same server.
+
+    :param urls: The webfinger URLs
+    :param dict cache: as in :py:func:`get_profiles`
+
+    :returns: A :py:type:`dict` mapping each URL to its :py:type:`set` of
+        potential identity URLs
+
+    """
+    urls = list(dict.fromkeys(urls))
+    return dict(zip(urls, utils.concurrent_map(lambda url: get_profiles(url, cache), urls)))
+
+
+def _lookup(user: str, domain: str, key: str, cache: dict) -> typing.FrozenSet[str]:
+    """ Retrieve the profiles for a webfinger address, caching the result """
+    resource = urllib.parse.quote(f'acct:{user}@{domain}', safe='@:')
+
+    # If the service doesn't support webfinger, just pretend it's the most
+    # common format for a profile page
+    fallback = frozenset((f'https://{domain}/@{user}',))
+
     try:
-        user, domain = webfinger.group(1, 2)
-        LOGGER.debug("webfinger: user=%s domain=%s", user, domain)
-
-        resource = html.escape(f'acct:{user}@{domain}')
-        request = requests.get(f'https://{domain}/.well-known/webfinger?resource={resource}')
-
-        if not 200 <= request.status_code < 300:
-            LOGGER.info("Webfinger query %s returned status code %d",
-                        resource, request.status_code)
-            LOGGER.debug("%s", request.text)
-            # Service doesn't support webfinger, so just pretend it's the most
-            # common format for a profile page
-            return {f'https://{domain}/@{user}'}
-
-        profile = request.json()
-        print(repr(profile))
-
-        return {link['href'] for link in profile['links']
-                if link['rel'] in ('http://webfinger.net/rel/profile-page', 'profile', 'self')}
-    except Exception:  # pylint:disable=broad-except
-        LOGGER.exception("Failed to decode %s profile", resource)
-        return set()
+        with utils.SESSION.get(f'https://{domain}/.well-known/webfinger?resource={resource}',
+                               timeout=utils.TIMEOUT, stream=True) as request:
+            content_type = request.headers.get('content-type', '')
+            if request.status_code == 429 or request.status_code >= 500:
+                LOGGER.warning("Webfinger query %s returned status code %d",
+                               resource, request.status_code)
+                # The server is having trouble, so only remember this briefly
+                _MALFORMED[key] = fallback
+                return fallback
+
+            if (not 200 <= request.status_code < 300
+                    or (content_type and 'json' not in content_type)):
+                LOGGER.info("Webfinger query %s returned status code %d (content-type: %s)",
+                            resource, request.status_code, content_type)
+                cache[key] = fallback
+                return fallback
+
+            body = b''.join(utils.iter_body(request, MAX_RESPONSE_SIZE, content_types=None))
+    except (requests.RequestException, urllib3.exceptions.HTTPError, ValueError) as err:
+        # This might be temporary (or a hostname that urllib3 refuses to
+        # connect to), so don't remember it
+        LOGGER.warning("Webfinger query %s failed: %s", resource, err)
+        return frozenset()
+
+    try:
+        profile = utils.parse_json(body)
+        hrefs = dict.fromkeys(link['href'] for link in profile.get('links', ())
+                              if link.get('rel') in _PROFILE_RELS and 'href' in link)
+        profiles = frozenset(list(hrefs)[:MAX_PROFILES])
+    except (AttributeError, KeyError, TypeError, ValueError) as err:
+        LOGGER.warning("Failed to decode %s profile: %s", resource, err)
+        # The server might get fixed, so only remember this briefly
+        _MALFORMED[key] = fallback
+        return fallback
+
+    cache[key] = profiles
+    return profiles
@@ -48,6 +48,7 @@ def test_basics():
 
     # strip out non-email-address components
     assert handler.handles_url('mailto:foo@example.com?subject=pwned') == 'mailto:foo@example.com'
+    assert handler.handles_url('mailto:foo@example.com#frag') == 'mailto:foo@example.com'
 
     # handle case correctly
     assert handler.handles_url('MailtO:Foo@Example.Com') == 'mailto:foo@example.com'
@@ -80,6 +81,27 @@ def test_success():
     assert result.cdata == 'some data'
 
 
+def test_template():
+    sent = []
+
+    def render(template):
+        handler = email_addr.EmailAddress(sent.append, None, tokens.DictStore(),
+                                          expires_time=120,
+                                          email_template_text=template)
+        handler.initiate_auth('mailto:user@example.com', 'http://example/cb', '/redir')
+        body = sent[-1].get_content()
+        return body, 'http://example/cb?' + body.split('?', 1)[1].split()[0]
+
+    body, url = render('Visit {url} within {minutes} minutes. {{url}}')
+    assert body == f'Visit {url} within 2 minutes. {{url}}\n'
+
+    body, url = render('{url}\n{url!r}')
+    assert body == f'{url}\n{url!r}\n'
+
+    body, url = render('{minutes:>4}{url}')
+    assert body == f'   2{url}\n'
+
+
 def test_failures(mocker):
     store = {}
     pending = {}
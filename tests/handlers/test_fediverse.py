@@ -51,6 +51,12 @@ def test_handles_url(requests_mock):
     assert not handler.handles_url('https://blah.example/')
     assert not handler.handles_url('https://also-not.example/')
 
+    # known instances shouldn't need to be probed again
+    requests_mock.reset()
+    assert handler.handles_url('https://mastodon.example/@fluffy') == \
+        'https://mastodon.example/@fluffy'
+    assert not requests_mock.called
+
 
 def test_auth_success(mocker, requests_mock):
     store = tokens.DictStore()
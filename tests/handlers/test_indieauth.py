@@ -4,12 +4,13 @@
 
 import json
 import logging
+import threading
 
 import pytest
 import requests
 from bs4 import BeautifulSoup
 
-from authl import disposition, tokens
+from authl import Authl, disposition, tokens
 from authl.handlers import indieauth
 
 from . import parse_args
@@ -21,6 +22,8 @@ LOGGER = logging.getLogger(__name__)
 def purge_endpoint_cache():
     # pylint:disable=protected-access
     indieauth._ENDPOINT_CACHE.clear()
+    indieauth._MISS_CACHE.clear()
+    indieauth._NO_HEAD.clear()
 
 
 def test_find_endpoint_by_url(requests_mock):
@@ -51,6 +54,11 @@ def test_find_endpoint_by_url(requests_mock):
     requests_mock.get('http://nothing/', text='nothing')
     assert find_endpoint('http://nothing/')[0] is None
 
+    # only the <head> is considered when there is one
+    requests_mock.get('http://in.body/', text='<html><head><title>hi</title></head><body>'
+                      '<link rel="authorization_endpoint" href="https://endpoint/">')
+    assert find_endpoint('http://in.body/')[0] is None
+
     assert find_endpoint('https://undefined.example')[0] is None
 
     # test the caching
@@ -61,11 +69,216 @@ def test_find_endpoint_by_url(requests_mock):
     assert find_endpoint('http://content.relative/')[0] == 'http://content.relative/endpoint'
     assert not requests_mock.called
 
-    # but a failed lookup shouldn't be cached
+    # a failed lookup should be cached too, but only briefly
+    assert find_endpoint('http://nothing/')[0] is None
+    assert not requests_mock.called
+
+    # pylint:disable=protected-access
+    indieauth._MISS_CACHE.clear()
     assert find_endpoint('http://nothing/')[0] is None
     assert requests_mock.called
 
 
+def test_find_endpoint_cache(requests_mock):
+    from authl.handlers.indieauth import find_endpoint
+    cache = {}
+
+    requests_mock.get('https://Example.User/', text='Nothing to see',
+                      headers={'Link': '<https://endpoint/>; rel="authorization_endpoint"'})
+
+    assert find_endpoint('https://Example.User/', cache=cache)[0] == 'https://endpoint/'
+    assert 'https://example.user/' in cache
+    assert requests_mock.call_count == 1
+
+    # host case and fragments don't matter for the cached value
+    assert find_endpoint('https://example.user/#me', cache=cache)[0] == 'https://endpoint/'
+    assert requests_mock.call_count == 1
+
+    # a handler should use the provided cache
+    handler = indieauth.IndieAuth('http://client/', tokens.DictStore(), endpoint_cache=cache)
+    assert handler.handles_url('https://EXAMPLE.user/') == 'https://example.user/'
+
+
+def test_miss_cache(requests_mock):
+    # pylint:disable=protected-access
+    handler = indieauth.from_config({
+        'INDIEAUTH_CLIENT_ID': 'http://client/',
+        'INDIEAUTH_MISS_TTL': 10,
+    }, tokens.DictStore())
+    assert handler._misses is not indieauth._MISS_CACHE
+    assert handler._misses.max_age == 10
+
+    misses = {}
+    handler = indieauth.IndieAuth('http://client/', tokens.DictStore(), miss_cache=misses)
+
+    requests_mock.get('https://no.endpoint/', text='<html><head></head></html>')
+    assert isinstance(handler.initiate_auth('https://no.endpoint/', 'http://cb/', ''),
+                      disposition.Error)
+    assert 'https://no.endpoint/' in misses
+    assert requests_mock.call_count == 1
+
+    # the page shouldn't be retrieved again while the miss is remembered
+    assert isinstance(handler.initiate_auth('https://No.Endpoint/', 'http://cb/', ''),
+                      disposition.Error)
+    assert requests_mock.call_count == 1
+
+
+def test_miss_cache_failures(requests_mock):
+    from authl.handlers.indieauth import find_endpoint
+    misses = {}
+
+    # network and server failures might be temporary, so they shouldn't be
+    # remembered as misses
+    requests_mock.get('https://flaky.example/', exc=requests.exceptions.ConnectTimeout)
+    assert find_endpoint('https://flaky.example/', miss_cache=misses)[0] is None
+    requests_mock.get('https://flaky.example/', status_code=503)
+    assert find_endpoint('https://flaky.example/', miss_cache=misses)[0] is None
+    assert not misses
+
+    requests_mock.get('https://flaky.example/',
+                      headers={'Link': '<https://endpoint/>; rel="authorization_endpoint"'})
+    assert find_endpoint('https://flaky.example/', miss_cache=misses)[0] == 'https://endpoint/'
+
+
+def test_scan_links():
+    # pylint:disable=protected-access
+    def scan(page):
+        return indieauth._scan_links(page.encode(), 'authorization_endpoint')
+
+    assert scan('<link rel="authorization_endpoint" href="https://foo/">') == 'https://foo/'
+    assert scan("<LINK href='/auth?a=1&amp;b=2' REL='me Authorization_Endpoint'>") \
+        == '/auth?a=1&b=2'
+    assert scan('<link rel=authorization_endpoint href=/auth />') == '/auth'
+    assert scan('<link rel=authorization_endpoint href=https://auth.example/?site=me>') \
+        == 'https://auth.example/?site=me'
+    assert scan('<link rel="authorization_endpoint-ish" href="/nope">') is None
+    assert scan('<!-- <link rel="authorization_endpoint" href="/old"> -->') is None
+    assert scan('<head></head><link rel="authorization_endpoint" href="/body">') is None
+
+
+def test_find_endpoint_redirected_relative(requests_mock):
+    requests_mock.get('https://old.example/u', status_code=301,
+                      headers={'Location': 'https://new.example/u/'})
+    requests_mock.get('https://new.example/u/',
+                      text='<link rel="authorization_endpoint" href="auth">')
+    assert indieauth.find_endpoint('https://old.example/u')[0] == 'https://new.example/u/auth'
+
+    requests_mock.get('https://old.example/v', status_code=301,
+                      headers={'Location': 'https://new.example/v/'})
+    requests_mock.get('https://new.example/v/',
+                      text='<link rel="authorization_endpoint" href="auth" class="x=y">')
+    assert indieauth.find_endpoint('https://old.example/v')[0] == 'https://new.example/v/auth'
+
+
+def test_find_endpoint_redirected_relative_handles_page(requests_mock):
+    # the endpoint has to come out the same whether the page was retrieved for
+    # handles_page or by find_endpoint itself
+    requests_mock.get('https://a.example/', status_code=302,
+                      headers={'Location': 'https://a.example/home/'})
+    requests_mock.get('https://a.example/home/',
+                      text='<html><head><link rel="authorization_endpoint" href="auth">'
+                      '</head></html>')
+
+    for first in ('get_handler_for_url', 'find_endpoint'):
+        cache: dict = {}
+        handler = indieauth.IndieAuth('http://client/', tokens.DictStore(),
+                                      endpoint_cache=cache, miss_cache={})
+        if first == 'get_handler_for_url':
+            assert Authl([handler]).get_handler_for_url('https://a.example/')[0] is handler
+        assert indieauth.find_endpoint('https://a.example/', cache=cache) == (
+            'https://a.example/home/auth', 'https://a.example/')
+
+
+def test_find_endpoint_separate_caches(requests_mock, mocker):
+    # simultaneous lookups into different caches each do their own retrieval
+    requests_mock.get('https://shared.example/',
+                      text='<link rel="authorization_endpoint" href="https://auth.example/">')
+    both_fetching = threading.Barrier(2, timeout=5)
+    request_url = indieauth.utils.request_url
+
+    def fetch(*args, **kwargs):
+        both_fetching.wait()
+        return request_url(*args, **kwargs)
+    mocker.patch('authl.utils.request_url', side_effect=fetch)
+
+    caches = [{}, {}]
+    threads = [threading.Thread(target=indieauth.find_endpoint,
+                                args=('https://shared.example/',),
+                                kwargs={'cache': cache, 'miss_cache': {}})
+               for cache in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    for cache in caches:
+        assert cache['https://shared.example/'] == ('https://auth.example/',
+                                                    'https://shared.example/')
+
+
+def test_find_endpoint_head_checked_once(requests_mock, mocker):
+    scan = mocker.spy(indieauth, '_scan_links')
+    parse = mocker.spy(indieauth, '_parse_links')
+    requests_mock.get('https://plain.example/',
+                      text='<html><head><title>hi</title></head><body>hello</body></html>')
+    assert indieauth.find_endpoint('https://plain.example/')[0] is None
+    assert scan.call_count == 1
+    assert parse.call_count == 1
+
+
+def test_find_endpoint_partial_read(requests_mock):
+    # pylint:disable=protected-access
+    page = ('<html><head><title>Hi</title></HEAD>'
+            + '<body>' + 'blah ' * 50000 + '</body></html>')
+    requests_mock.get('http://big.page/', text=page)
+
+    # nothing useful in the <head>, so only the first chunk gets read
+    content, found = indieauth._read_page(requests.get('http://big.page/', stream=True),
+                                          lambda head: None)
+    assert b'</HEAD>' in content
+    assert len(content) < len(page)
+    assert found is None
+
+    content, found = indieauth._read_page(requests.get('http://big.page/', stream=True),
+                                          lambda head: head.endswith(b'</HEAD>'))
+    assert content == page.encode()
+    assert found is True
+
+    # without a distinct <head>, the whole page gets checked
+    requests_mock.get('http://headless.page/', text='<p>hi</p>')
+    assert indieauth._read_page(requests.get('http://headless.page/', stream=True),
+                                len) == (b'<p>hi</p>', 9)
+
+    assert indieauth.find_endpoint('http://big.page/')[0] is None
+
+
+def test_find_endpoint_head_end(requests_mock):
+    # pylint:disable=protected-access
+    page = ('<html><head><script>var s="</head>";</script><!-- </head> -->'
+            '<link rel="authorization_endpoint" href="https://auth.example/"></head>'
+            '<body>hi</body></html>')
+    assert indieauth._get_head(page.encode()).endswith(b'</head>')
+    assert b'<link' in indieauth._get_head(page.encode())
+    assert indieauth._get_head(b'<head><script>"</head>"') == b'<head><script>"</head>"'
+
+    requests_mock.get('http://tricky.page/', text=page)
+    assert indieauth.find_endpoint('http://tricky.page/')[0] == 'https://auth.example/'
+
+    handler = indieauth.IndieAuth('http://client/', tokens.DictStore())
+    assert handler.handles_page('http://tricky.page/', {},
+                                BeautifulSoup(page, 'html.parser'), {})
+
+    # a link outside of the <head> is ignored whether or not we have the tree
+    body_link = ('<html><head><title>x</title></head><body>'
+                 '<link rel="authorization_endpoint" href="https://auth.example/">'
+                 '</body></html>')
+    requests_mock.get('http://body.page/', text=body_link)
+    assert indieauth.find_endpoint('http://body.page/')[0] is None
+    handler = indieauth.IndieAuth('http://client/', tokens.DictStore())
+    assert not handler.handles_page('http://body.page/', {},
+                                    BeautifulSoup(body_link, 'html.parser'), {})
+
+
 def test_find_endpoint_redirections(requests_mock):
     from authl.handlers.indieauth import find_endpoint
     # test that redirections get handled correctly
@@ -109,6 +322,11 @@ def test_find_endpoint_by_content(requests_mock):
     # final result should be cached
     assert find_endpoint('http://example')[0] == 'http://link_endpoint'
 
+    # a page that was provided without an endpoint shouldn't be retrieved again
+    no_endpoint = BeautifulSoup('<link rel="stylesheet" href="foo.css">', 'html.parser')
+    assert find_endpoint('http://other', links=None, content=no_endpoint)[0] is None
+    assert find_endpoint('http://other', links={'me': {'url': 'http://foo'}})[0] is None
+
     assert not requests_mock.called
 
 
@@ -119,6 +337,9 @@ def test_verify_id(requests_mock):
     # Same URL is always allowed
     assert indieauth.verify_id('https://matching.example',
                                'https://matching.example') == 'https://matching.example'
+    assert indieauth.verify_id('https://Matching.Example/',
+                               'https://matching.example/#me') == 'https://matching.example/#me'
+    assert not requests_mock.called
 
     # Different URL is allowed as long as the endpoints match
     requests_mock.get('https://different.example/1', headers=endpoint_1)
@@ -154,6 +375,24 @@ def test_verify_id(requests_mock):
     assert indieauth.verify_id('https://redir.example/user',
                                'https://redir.example/temp') == 'https://redir.example/temp'
 
+    # the original page's endpoint can come from a HEAD request
+    requests_mock.head('https://head.example/user', headers=endpoint_1)
+    requests_mock.get('https://head.example/me', headers=endpoint_1)
+    assert indieauth.verify_id('https://head.example/user',
+                               'https://head.example/me') == 'https://head.example/me'
+    assert sorted(req.method for req in requests_mock.request_history[-2:]) == ['GET', 'HEAD']
+
+    # origins that reject HEAD don't get asked again
+    requests_mock.head('https://nohead.example/user', status_code=405)
+    requests_mock.head('https://nohead.example/other', status_code=405)
+    requests_mock.get('https://nohead.example/user', headers=endpoint_1)
+    requests_mock.get('https://nohead.example/other', headers=endpoint_1)
+    requests_mock.get('https://nohead.example/me', headers=endpoint_1)
+    indieauth.verify_id('https://nohead.example/user', 'https://nohead.example/me')
+    requests_mock.reset_mock()
+    indieauth.verify_id('https://nohead.example/other', 'https://nohead.example/me')
+    assert [req.method for req in requests_mock.request_history] == ['GET']
+
     # Target page must have an endpoint
     requests_mock.get('https://missing.example/src', headers=endpoint_1)
     requests_mock.get('https://missing.example/dest', text='foo')
@@ -161,6 +400,20 @@ def test_verify_id(requests_mock):
         indieauth.verify_id('https://matching.example/src', 'https://missing.example/dest')
 
 
+def test_verify_id_timeout(mocker):
+    release = threading.Event()
+    mocker.patch('authl.handlers.indieauth.VERIFY_TIMEOUT', 0.1)
+    mocker.patch('authl.handlers.indieauth.find_endpoint',
+                 side_effect=lambda url, **_: release.wait() and ('https://auth/', url))
+
+    try:
+        with pytest.raises(ValueError, match='Timed out'):
+            indieauth.verify_id('https://slow.example/1', 'https://slow.example/2')
+    finally:
+        # don't leave the lookups holding on to the shared pool
+        release.set()
+
+
 def test_handler_success(requests_mock):
     store = {}
     handler = indieauth.IndieAuth('http://client/', tokens.DictStore(store))
@@ -181,7 +434,7 @@ def test_handler_success(requests_mock):
     # it should not handle the URL on its own
     assert not handler.handles_url('http://example.user/')
     assert handler.handles_page('http://example.user/', injected.headers,
-                                BeautifulSoup(injected.text, 'html.parser'),
+                                lambda: BeautifulSoup(injected.text, 'html.parser'),
                                 injected.links)
 
     # and now the URL should be cached
@@ -194,10 +447,11 @@ def test_handler_success(requests_mock):
     # fake the user dialog on the IndieAuth endpoint
     user_get = parse_args(disp.url)
     assert user_get['redirect_uri'].startswith('http://client/cb')
-    assert 'client_id' in user_get
+    assert user_get['client_id'] == 'http://client/'
     assert 'state' in user_get
     assert user_get['state'] in store
     assert user_get['response_type'] == 'code'
+    assert user_get['scope'] == 'profile'
     assert 'me' in user_get
 
     # fake the verification response
@@ -236,6 +490,29 @@ def test_handler_success(requests_mock):
     assert isinstance(response, disposition.Error)
 
 
+def test_handler_reuses_discovery(requests_mock):
+    handler = indieauth.IndieAuth('http://client/', tokens.DictStore())
+    instance = Authl([handler])
+
+    # profile page at https://example.user/ temporarily redirects to /home
+    requests_mock.get('https://example.user/', status_code=302,
+                      headers={'Location': 'https://example.user/home'})
+    requests_mock.get('https://example.user/home', headers={
+        'Link': '<https://auth.example/endpoint>; rel="authorization_endpoint"'})
+
+    found, _, id_url = instance.get_handler_for_url('https://example.user/')
+    assert found is handler
+    assert id_url == 'https://example.user/'
+    call_count = requests_mock.call_count
+
+    # initiating the login should not need to retrieve the page again
+    disp = handler.initiate_auth(id_url, 'http://client/cb', '/dest')
+    assert isinstance(disp, disposition.Redirect)
+    assert disp.url.startswith('https://auth.example/endpoint')
+    assert parse_args(disp.url)['me'] == 'https://example.user/'
+    assert requests_mock.call_count == call_count
+
+
 def test_handler_failures(requests_mock):
     store = {}
     handler = indieauth.IndieAuth('http://client/', tokens.DictStore(store), 10)
@@ -291,6 +568,14 @@ def test_handler_failures(requests_mock):
     requests_mock.post('http://endpoint/', status_code=400)
     check_failure('returned 400')
 
+    # endpoint doesn't respond in time
+    requests_mock.post('http://endpoint/', exc=requests.exceptions.ConnectTimeout)
+    check_failure('timed out')
+
+    # endpoint can't be reached at all
+    requests_mock.post('http://endpoint/', exc=requests.exceptions.ConnectionError)
+    check_failure('Could not reach')
+
     # callback returns broken JSON
     requests_mock.post('http://endpoint/', text='invalid json')
     check_failure('invalid response JSON')
@@ -307,6 +592,31 @@ def test_handler_failures(requests_mock):
     check_failure('Authorization endpoint mismatch')
 
 
+def test_serialized_state(requests_mock):
+    store = tokens.Serializer('secret')
+    handler = indieauth.IndieAuth('http://client/', store)
+
+    requests_mock.get('http://example.user/',
+                      headers={'Link': '<http://endpoint/>; rel="authorization_endpoint"'})
+    requests_mock.post('http://endpoint/', json={'me': 'http://example.user/'})
+
+    response = handler.initiate_auth('http://example.user/', 'http://client/cb', '/dest')
+    assert isinstance(response, disposition.Redirect)
+    response = handler.check_callback('http://client/cb',
+                                      {'state': parse_args(response.url)['state'],
+                                       'code': 'asdf'}, {})
+    assert isinstance(response, disposition.Verified), response.message
+    assert response.identity == 'http://example.user/'
+    assert response.redir == '/dest'
+
+    # a validly-signed state of the wrong shape
+    response = handler.check_callback('http://client/cb',
+                                      {'state': store.put(('http://example.user/',)),
+                                       'code': 'asdf'}, {})
+    assert isinstance(response, disposition.Error)
+    assert 'Invalid token' in response.message
+
+
 def test_login_timeout(mocker, requests_mock):
     store = {}
     handler = indieauth.IndieAuth('http://client/', tokens.DictStore(store), 10)
@@ -332,6 +642,34 @@ def test_login_timeout(mocker, requests_mock):
     assert len(store) == 0
 
 
+def test_dynamic_client_id(requests_mock):
+    client_ids = iter(('http://client/1', 'http://client/2'))
+    handler = indieauth.IndieAuth(lambda: next(client_ids), tokens.DictStore())
+
+    requests_mock.get('http://example.user/',
+                      headers={'Link': '<http://endpoint/>; rel="authorization_endpoint"'})
+
+    for expected in ('http://client/1', 'http://client/2'):
+        response = handler.initiate_auth('http://example.user/', 'http://client/cb', '/dest')
+        assert parse_args(response.url)['client_id'] == expected
+
+
+def test_endpoint_with_query(requests_mock):
+    handler = indieauth.IndieAuth('http://client/', tokens.DictStore())
+
+    requests_mock.get('http://example.user/',
+                      headers={'Link': '<http://endpoint/?site=1>; rel="authorization_endpoint"'})
+
+    response = handler.initiate_auth('http://example.user/', 'http://client/cb?x=y&z', '/dest')
+    assert response.url.startswith('http://endpoint/?site=1&')
+    args = parse_args(response.url)
+    assert args['site'] == '1'
+    assert args['client_id'] == 'http://client/'
+    assert args['redirect_uri'] == 'http://client/cb?x=y&z'
+    assert args['me'] == 'http://example.user/'
+    assert args['response_type'] == 'code'
+
+
 def test_from_config():
     # pylint:disable=protected-access
     handler = indieauth.from_config({'INDIEAUTH_CLIENT_ID': 'poiu',
@@ -379,7 +717,7 @@ def test_get_profile(requests_mock):
 
     injected = requests.get('https://cached.example')
     assert handler.handles_page('https://cached.example', injected.headers,
-                                BeautifulSoup(injected.text, 'html.parser'),
+                                lambda: BeautifulSoup(injected.text, 'html.parser'),
                                 injected.links)
     assert profile_mock.call_count == 1
 
@@ -79,6 +79,10 @@ def test_auth_success(mocker, requests_mock):
     assert isinstance(result, disposition.Error)
     assert 'Invalid transaction' in result.message
 
+    result = handler.check_callback('foo', {}, {})
+    assert isinstance(result, disposition.Error)
+    assert 'Invalid transaction' in result.message
+
     requests_mock.get('https://api.twitter.com/1.1/account/verify_credentials.json?skip_status=1',
                       json={'screen_name': 'foo',
                             'id_str': '12345'})
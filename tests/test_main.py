@@ -4,6 +4,7 @@ import pytest
 
 import authl
 from authl import Authl, tokens
+from authl.handlers import indieauth
 
 from . import TestHandler
 
@@ -23,6 +24,23 @@ class UrlHandler(TestHandler):
         return url if url == self.url else None
 
 
+class SchemeHandler(UrlHandler):
+    """ a URL handler that only claims specific URL schemes """
+
+    def __init__(self, url, cid, schemes):
+        super().__init__(url, cid)
+        self.schemes = schemes
+        self.checked = []
+
+    @property
+    def handled_schemes(self):
+        return self.schemes
+
+    def handles_url(self, url):
+        self.checked.append(url)
+        return super().handles_url(url)
+
+
 class LinkHandler(TestHandler):
     """ a handler that just handles a page with a particular link rel """
 
@@ -35,7 +53,7 @@ class LinkHandler(TestHandler):
         return self.cid
 
     def handles_page(self, url, headers, content, links):
-        return self.rel in links or content.find('link', rel=self.rel)
+        return self.rel in links or content().find('link', rel=self.rel)
 
 
 def test_register_handler():
@@ -85,6 +103,71 @@ def test_get_handler_for_url(requests_mock):
     assert instance.get_handler_for_url('') == (None, '', '')
 
 
+def test_page_parsed_on_demand(requests_mock, mocker):
+    """ Test that the page only gets parsed if a handler needs it """
+    parse = mocker.spy(authl.utils, 'BeautifulSoup')
+    instance = Authl([LinkHandler('moo', 'c'), LinkHandler('quack', 'd')])
+
+    requests_mock.get('http://moo/header', headers={'Link': '<gabba>; rel="moo"'})
+    requests_mock.get('http://moo/link', text='<link rel="quack" href="yes">')
+
+    assert instance.get_handler_for_url('http://moo/header')[1] == 'c'
+    assert parse.call_count == 0
+
+    assert instance.get_handler_for_url('http://moo/link')[1] == 'd'
+    assert parse.call_count == 1
+
+
+def test_page_parsed_on_demand_indieauth(requests_mock, mocker):
+    """ Test that IndieAuth discovery doesn't need the page to be parsed """
+    # pylint:disable=protected-access
+    parse = mocker.spy(authl.utils, 'BeautifulSoup')
+    prefill = mocker.spy(indieauth, 'get_profile')
+    handler = indieauth.IndieAuth('http://client/', tokens.DictStore(),
+                                  endpoint_cache={}, miss_cache={})
+    instance = Authl([handler])
+
+    requests_mock.get('http://indie/header',
+                      headers={'Link': '<https://auth/>; rel="authorization_endpoint"'},
+                      text='<div class="h-card">me</div>')
+    requests_mock.get('http://indie/link',
+                      text='<html><head><link rel="authorization_endpoint" href="/auth">'
+                      '</head><body><div class="h-card">me</div></body></html>')
+    requests_mock.get('http://indie/nothing', text='<html><head></head><body>hi</body></html>')
+
+    assert instance.get_handler_for_url('http://indie/header')[0] is handler
+    assert instance.get_handler_for_url('http://indie/link')[0] is handler
+    assert instance.get_handler_for_url('http://indie/nothing')[0] is None
+    assert parse.call_count == 0
+    assert prefill.call_count == 0
+
+    assert indieauth.find_endpoint('http://indie/link', cache=handler._endpoints) == (
+        'http://indie/auth', 'http://indie/link')
+
+
+def test_scheme_dispatch():
+    """ Test that handlers are only consulted for the schemes they claim """
+    handler_1 = SchemeHandler('foo:bar', 'a', ('foo',))
+    handler_2 = UrlHandler('bar:baz', 'b')
+    handler_3 = SchemeHandler('bar:baz', 'c', ('bar', 'baz'))
+    handler_4 = UrlHandler('baz:qwer', 'd')
+    instance = Authl([handler_1, handler_2, handler_3, handler_4])
+
+    assert instance.get_handler_for_url('foo:bar') == (handler_1, 'a', 'foo:bar')
+    assert handler_1.checked == ['foo:bar']
+    assert not handler_3.checked
+
+    # priority order is kept between specific and generic handlers
+    assert instance.get_handler_for_url('bar:baz') == (handler_2, 'b', 'bar:baz')
+    assert instance.get_handler_for_url('baz:qwer') == (handler_4, 'd', 'baz:qwer')
+    assert handler_1.checked == ['foo:bar']
+    assert handler_3.checked == ['baz:qwer']
+
+    # unclaimed schemes check everything
+    assert instance.get_handler_for_url('qwer:poiu') == (None, '', '')
+    assert handler_1.checked == ['foo:bar', 'qwer:poiu']
+
+
 def test_webmention_url(mocker):
     """ test handles_url on a webmention profile """
     handler_1 = UrlHandler('test://foo', 'a')
@@ -92,11 +175,33 @@ def test_webmention_url(mocker):
     instance = Authl([handler_1, handler_2])
 
     wgp = mocker.patch('authl.webfinger.get_profiles')
-    wgp.side_effect = lambda url: {'test://cat', 'test://bar'} if url == '@foo@bar.baz' else {}
+    wgp.side_effect = lambda url, _: {'test://cat', 'test://bar'} if url == '@foo@bar.baz' else {}
 
     assert instance.get_handler_for_url('@foo@bar.baz') == (handler_2, 'b', 'test://bar')
 
 
+def test_webfinger_loop(requests_mock):
+    """ a webfinger profile that points back at webfinger addresses shouldn't
+    tie up the lookup pool """
+    import threading
+
+    instance = Authl([UrlHandler('test://foo', 'a')], webfinger_cache={})
+    for user in ('a', 'b'):
+        requests_mock.get(
+            f'https://evil.example/.well-known/webfinger?resource=acct:{user}@evil.example',
+            json={'links': [{'rel': 'self', 'href': '@a@evil.example'},
+                            {'rel': 'self', 'href': '@b@evil.example'}]})
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(instance.get_handler_for_url('@a@evil.example')),
+        daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert results == [(None, '', '')]
+
+
 def test_from_config(mocker):
     """ Ensure the main from_config function calls the appropriate proxied ones """
     test_config = {
@@ -2,9 +2,11 @@
 # pylint:disable=missing-docstring
 
 
+import pytest
 import requests
 
 from authl import utils
+from authl.handlers import indieauth
 
 
 def test_request_url(requests_mock):
@@ -25,6 +27,135 @@ def test_request_url(requests_mock):
     assert utils.request_url('has.links').links['bar']['url'] == 'https://foo'
 
 
+def test_request_url_limits(requests_mock, mocker):
+    mocker.patch('authl.utils.MAX_BODY_SIZE', 100)
+
+    requests_mock.get('https://big.example/', text='x' * 1000,
+                      headers={'Content-Type': 'text/html; charset=utf-8'})
+    assert utils.request_url('https://big.example/').text == 'x' * 100
+
+    requests_mock.get('https://untyped.example/', text='y' * 50)
+    assert utils.request_url('https://untyped.example/').text == 'y' * 50
+
+    requests_mock.get('https://image.example/', content=b'GIF89a', headers={
+        'Content-Type': 'image/gif',
+        'Link': '<https://foo>; rel="bar"'})
+    response = utils.request_url('https://image.example/')
+    assert response.content == b''
+    assert response.links['bar']['url'] == 'https://foo'
+
+
+def test_concurrent_map():
+    import contextvars
+    import threading
+
+    var = contextvars.ContextVar('var')
+    var.set('context')
+
+    def func(item):
+        return item * 2, var.get(), threading.current_thread().name
+
+    assert list(utils.concurrent_map(func, [])) == []
+    assert [result[0] for result in utils.concurrent_map(func, [1])] == [2]
+
+    results = list(utils.concurrent_map(func, range(5)))
+    assert [result[0] for result in results] == [0, 2, 4, 6, 8]
+    assert all(result[1] == 'context' for result in results)
+    assert all(result[2].startswith('authl') for result in results)
+
+
+def test_concurrent_map_nested():
+    # calls from within the pool mustn't wait on the pool
+    def outer(item):
+        return list(utils.concurrent_map(lambda x: x + item, range(3)))
+
+    import threading
+
+    results: list = []
+    thread = threading.Thread(
+        target=lambda: results.extend(utils.concurrent_map(outer, range(16))),
+        daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert results == [[item, item + 1, item + 2] for item in range(16)]
+
+
+def test_concurrent_map_fanout():
+    import threading
+    import time
+
+    lock = threading.Lock()
+    started: list = []
+    running = [0, 0]  # current, peak
+
+    def func(item):
+        with lock:
+            started.append(item)
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return item
+
+    # one caller only gets part of the pool
+    assert list(utils.concurrent_map(func, range(12))) == list(range(12))
+    assert running[1] <= utils.MAX_FANOUT
+
+    # and stopping early cancels whatever hasn't started
+    started.clear()
+    for result in utils.concurrent_map(func, range(12)):
+        if result == 0:
+            break
+    time.sleep(0.3)
+    assert len(started) <= utils.MAX_FANOUT + 1
+
+
+def test_single_flight():
+    import threading
+    import time
+
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait()
+        return 'result'
+
+    results: list = []
+    threads = [threading.Thread(target=lambda: results.append(utils.single_flight('key', slow)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+
+    # once it's done, the next call runs again
+    assert utils.single_flight('key', lambda: 'again') == 'again'
+
+    def fail():
+        raise ValueError("nope")
+
+    with pytest.raises(ValueError):
+        utils.single_flight('key', fail)
+    assert utils.single_flight('key', lambda: 'recovered') == 'recovered'
+
+
+def test_parse_json():
+    assert utils.parse_json(b'{"me": "https://example.com/"}') == {'me': 'https://example.com/'}
+    assert utils.parse_json('[1, 2]') == [1, 2]
+
+    with pytest.raises(ValueError):
+        utils.parse_json(b'invalid json')
+
+
 def test_resolve_value():
     def moo():
         return 5
@@ -32,6 +163,16 @@ def test_resolve_value():
     assert utils.resolve_value(10) == 10
 
 
+def test_cache_key():
+    assert utils.cache_key('https://Example.COM/Path#frag') == 'https://example.com/Path'
+    assert utils.cache_key('https://example.com') == 'https://example.com/'
+    assert utils.cache_key('https://example.com:443/') == 'https://example.com/'
+    assert utils.cache_key('http://example.com:80') == 'http://example.com/'
+    assert utils.cache_key('https://example.com:80/') == 'https://example.com:80/'
+    assert utils.cache_key('http://example.com/') != utils.cache_key('https://example.com/')
+    assert utils.cache_key('foo@example.com') == 'foo@example.com'
+
+
 def test_permanent_url(requests_mock):
     requests_mock.get('http://make-secure.example', status_code=301,
                       headers={'Location': 'https://make-secure.example'})
@@ -82,3 +223,27 @@ def test_permanent_url(requests_mock):
     assert req.url == 'https://four/'
     assert utils.permanent_url(req) == 'https://four/'
     assert req.text == 'done'
+
+
+def test_html_parser_fallback(mocker, requests_mock):
+    # pylint:disable=protected-access
+    assert utils._html_parser() == 'lxml'
+    mocker.patch('importlib.util.find_spec', return_value=None)
+    assert utils._html_parser() == 'html.parser'
+
+    # discovery still works with the standard library parser (the '>' in the
+    # attribute defeats the scan, so the page has to be parsed)
+    mocker.patch.object(utils, 'HTML_PARSER', 'html.parser')
+    requests_mock.get('https://fallback.example/',
+                      text='<html><head><link data-x="a>b" rel="authorization_endpoint" '
+                      'href="/auth"></head></html>')
+    assert indieauth.find_endpoint('https://fallback.example/',
+                                   cache={}, miss_cache={})[0] == 'https://fallback.example/auth'
+
+
+def test_session_retries():
+    # a failed connection or read is never retried, bounding each request by TIMEOUT
+    for url in ('https://example.com/', 'http://example.com/'):
+        retries = utils.SESSION.get_adapter(url).max_retries
+        assert retries.connect == 0
+        assert retries.read == 0
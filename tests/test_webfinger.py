@@ -2,13 +2,28 @@
 # pylint:disable=missing-docstring
 
 
-from authl import webfinger
+import pytest
+import requests
+import urllib3
+
+from authl import Authl, tokens, webfinger
+from authl.handlers.indieauth import IndieAuth
+
+
+@pytest.fixture(autouse=True)
+def purge_profile_cache():
+    # pylint:disable=protected-access
+    webfinger._PROFILE_CACHE.clear()
+    webfinger._MALFORMED.clear()
 
 
 def test_not_address(requests_mock):
     assert webfinger.get_profiles("http://example.com") == set()
     assert webfinger.get_profiles("foo@bar.baz") == set()
     assert webfinger.get_profiles("@quux") == set()
+    assert webfinger.get_profiles("@foo@bar.baz/path?x=y") == set()
+    assert webfinger.get_profiles("@foo@bar.baz#frag") == set()
+    assert webfinger.get_profiles("@foo bar@baz.example") == set()
 
     assert not requests_mock.called
 
@@ -18,6 +33,11 @@ def test_no_resource(requests_mock):
                       status_code=404)
     assert webfinger.get_profiles("@404@example.com") == {"https://example.com/@404"}
 
+    # a page that isn't a webfinger response gets the same treatment
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:html@example.com',
+                      text='<html>hello</html>', headers={'Content-Type': 'text/html'})
+    assert webfinger.get_profiles("@html@example.com") == {"https://example.com/@html"}
+
 
 def test_resource(requests_mock):
     requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:profile@example.com',
@@ -56,8 +76,124 @@ def test_resource(requests_mock):
 
     assert webfinger.get_profiles("@empty@example.com") == set()
 
+    # malformed link entries are skipped
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:sloppy@example.com',
+                      json={
+                          "links": [{
+                              "rel": "self",
+                          }, {
+                              "href": "https://example.com/no-rel",
+                          }, {
+                              "rel": "profile",
+                              "href": "https://example.com/u/sloppy"
+                          }]
+                      })
+    assert webfinger.get_profiles("@sloppy@example.com") == {'https://example.com/u/sloppy'}
+
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:nolinks@example.com',
+                      json={"subject": "acct:nolinks@example.com"})
+    assert webfinger.get_profiles("@nolinks@example.com") == set()
+
 
 def test_invalid(requests_mock):
     requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:invalid@example.com',
                       text="""This is not valid JSON""")
-    assert webfinger.get_profiles('@invalid@example.com') == set()
+    assert webfinger.get_profiles('@invalid@example.com') == {'https://example.com/@invalid'}
+
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:list@example.com',
+                      json=['not', 'an', 'object'])
+    assert webfinger.get_profiles('@list@example.com') == {'https://example.com/@list'}
+
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:error@example.com',
+                      exc=requests.exceptions.ConnectionError)
+    assert webfinger.get_profiles('@error@example.com') == set()
+
+
+def test_cache(requests_mock):
+    cache = {}
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:cached@example.com',
+                      json={"links": [{"rel": "self", "href": "https://example.com/u/cached"}]})
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:404@example.com',
+                      status_code=404)
+
+    assert webfinger.get_profiles("@cached@example.com", cache) == {'https://example.com/u/cached'}
+    assert webfinger.get_profiles("@404@example.com", cache) == {'https://example.com/@404'}
+    assert len(cache) == 2
+
+    requests_mock.reset()
+    assert webfinger.get_profiles("@cached@EXAMPLE.com",
+                                  cache) == {'https://example.com/u/cached'}
+    assert webfinger.get_profiles("@404@example.com", cache) == {'https://example.com/@404'}
+    assert not requests_mock.called
+
+    # network failures shouldn't be cached
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:down@example.com',
+                      exc=requests.exceptions.ConnectTimeout)
+    assert webfinger.get_profiles('@down@example.com', cache) == set()
+    assert len(cache) == 2
+
+    # malformed responses only get remembered briefly
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:invalid@example.com',
+                      text="""This is not valid JSON""")
+    assert webfinger.get_profiles('@invalid@example.com',
+                                  cache) == {'https://example.com/@invalid'}
+    assert len(cache) == 2
+    requests_mock.reset()
+    assert webfinger.get_profiles('@invalid@example.com',
+                                  cache) == {'https://example.com/@invalid'}
+    assert not requests_mock.called
+
+
+def test_too_many_profiles(requests_mock):
+    links = [{"rel": "self", "href": f"https://example.com/u/{idx}"} for idx in range(100)]
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:many@example.com',
+                      json={"links": links})
+    assert webfinger.get_profiles('@many@example.com') == {
+        f'https://example.com/u/{idx}' for idx in range(webfinger.MAX_PROFILES)}
+
+
+def test_server_error(requests_mock):
+    # pylint:disable=protected-access
+    cache = {}
+    url = 'https://example.com/.well-known/webfinger?resource=acct:busy@example.com'
+    for status in (429, 503):
+        requests_mock.get(url, status_code=status)
+        webfinger._MALFORMED.clear()
+        assert webfinger.get_profiles('@busy@example.com', cache) == {'https://example.com/@busy'}
+        assert not cache
+
+
+def test_malformed_host(requests_mock):
+    # urllib3 rejects some hostnames which the address pattern allows
+    host = 'a' * 70 + '.com'
+    requests_mock.get(f'https://{host}/.well-known/webfinger?resource=acct:u@{host}',
+                      exc=urllib3.exceptions.LocationParseError(host))
+    cache = {}
+    assert webfinger.get_profiles(f'@u@{host}', cache) == set()
+    assert not cache
+
+    instance = Authl([IndieAuth('http://client/', tokens.DictStore())])
+    assert instance.get_handler_for_url(f'@u@{host}') == (None, '', '')
+
+
+def test_timeout(requests_mock):
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:slow@example.com',
+                      exc=requests.exceptions.ReadTimeout)
+    assert webfinger.get_profiles('@slow@example.com') == set()
+
+
+def test_batch(requests_mock):
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:one@example.com',
+                      json={"links": [{"rel": "self", "href": "https://example.com/u/one"}]})
+    requests_mock.get('https://example.com/.well-known/webfinger?resource=acct:two@example.com',
+                      status_code=404)
+
+    assert webfinger.get_profiles_batch(['@one@example.com', '@two@example.com',
+                                         '@one@example.com', 'not-an-address']) == {
+        '@one@example.com': {'https://example.com/u/one'},
+        '@two@example.com': {'https://example.com/@two'},
+        'not-an-address': set(),
+    }
+    assert requests_mock.call_count == 2
+
+    assert webfinger.get_profiles_batch([]) == {}